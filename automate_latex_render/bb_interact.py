@@ -18,7 +18,7 @@ indivually. Copy the current url of this page to your clipboard.
 
 The file can then be run with
 
-    python3 bb_interact.py 'Blackboard url' [--hide] [--randomise]
+    python3 bb_interact.py 'Blackboard url' [--hide] [--randomise] [--workers N]
 
 Where the blackboard url should be placed between quotations.
 
@@ -28,53 +28,140 @@ terminal rather than the secure login page directly.
 
 The optional --randomise flag will check the box to randomise the order in
 which answers are displayed for the multi choice and multi answer questions
+
+The optional --workers flag edits the questions in N browsers at once, each
+handling every Nth question. The login is only entered once and shared with
+the other browsers. This is experimental: it has not been tested against a
+live Blackboard test and parallel edits in one session may interfere, so check
+the questions afterwards. A failed worker makes the script exit non-zero.
 """
 
-import time
 import selenium
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException, ElementClickInterceptedException
+from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 import sys
 
-def randomise_answers(driver, button_id): 
-    try: 
-        # Checking for answer randomise button (assumes this is wanted) 
-        random_button = driver.find_element(By.ID, button_id) 
-        if not random_button.is_selected():
-            print('clicking "randomise answers"')
-            random_button.click()
-    
+def randomise_answers(driver, button_ids):
+    # Tick any randomise checkboxes on the page in a single round trip. A JS
+    # click is not blocked by the submit button overlapping the checkbox.
+    found = driver.execute_script("""
+        var found = 0;
+        for (var id of arguments[0]) {
+            var button = document.getElementById(id);
+            if (button) {
+                found++;
+                if (!button.checked) { button.click(); }
+            }
+        }
+        return found;""", button_ids)
+    if found:
         print('randomised answers selected')
-    except ElementClickInterceptedException:
-        # Button is obstructed by submit button so scroll down to it
-        driver.execute_script("window.scrollTo(0,1000);") 
-        try:
-            random_button.click() 
-            print('randomised answers selected')
-        except Exception as e: 
-            print('unexpected error in randomise, continuing') 
-            pass 
-    except Exception: 
-        # No randomise button found, move on
-        pass
+
+def wait_ready(driver, old_element, timeout=10):
+    # Wait for the page load triggered by the last click to finish. The old page
+    # still reports 'complete' until it is replaced so first wait for an element
+    # of it to go stale.
+    WebDriverWait(driver, timeout).until(EC.staleness_of(old_element))
+    WebDriverWait(driver, timeout).until(
+        lambda d: d.execute_script('return document.readyState') == 'complete')
 
 def login(driver):
     user = input('Please type your username: ')
-    user_in = driver.find_element(By.ID, 'username').send_keys(user)
+    user_in = WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.ID, 'username'))).send_keys(user)
 
     password = input('Please type your password: ')
     pass_in = driver.find_element(By.ID, 'password').send_keys(password)
 
     driver.find_element(By.ID, 'submit').click()
 
-def main(url, hide, randomise):
+def new_driver(hide):
     options = webdriver.ChromeOptions()
+    # Return from driver.get() once the DOM is ready, explicit waits do the rest
+    options.page_load_strategy = 'eager'
     if hide:
         options.add_argument('headless');
+        # Only form elements are used so skip rendering anything else
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option(
+            'prefs', {'profile.managed_default_content_settings.images': 2})
     driver = webdriver.Chrome(options=options)
+    # Only explicit waits are used below, never mix them with implicit ones
+    driver.implicitly_wait(0)
+    return driver
+
+def edit_questions(driver, indices, num_leading_arrows, num_questions, randomise):
+    # Open and submit the edit page of each question whose arrow index is in indices
+    for i in indices:
+        # Each submit reloads the test page (waited for at the end of the last
+        # iteration) so the arrows are looked up again on the new page
+        arrow_buttons = WebDriverWait(driver, 10).until(
+            EC.presence_of_all_elements_located((By.CSS_SELECTOR, "[class='contextMenuContainer']")))
+        print('clicking on arrow')
+        arrow_buttons[i].click()
+        edit_buttons = WebDriverWait(driver, 10).until(
+            EC.presence_of_all_elements_located((By.CSS_SELECTOR, "[id^='modify_test']")))
+
+        assert len(edit_buttons) == 2, '\n\n  Edit button not found, run without --hide flag'
+        print('clicking on edit')
+        edit_buttons[0].click()
+        wait_ready(driver, edit_buttons[0])
+        # Wait for the edit page form (either a Submit or a Next button)
+        WebDriverWait(driver, 10).until(
+            lambda d: d.find_elements(By.NAME, "bottom_Submit")
+                   or d.find_elements(By.NAME, "bottom_Next"))
+        if randomise:
+            randomise_answers(driver, ['fRandomOrder', 'randomOrderId'])
+        submit_buttons = driver.find_elements(By.NAME, "bottom_Submit")
+        if submit_buttons:
+            submit_button = submit_buttons[0]
+        else:
+            print('failed to find submit, looking for next button')
+            next_button = WebDriverWait(driver, 10).until(
+                EC.element_to_be_clickable((By.NAME, "bottom_Next")))
+            print('found next button')
+            next_button.click()
+            wait_ready(driver, next_button)
+            print('clicked next button')
+            submit_button = WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.NAME, "bottom_Submit")))
+           
+        submit_button.click()
+        # Make sure the next iteration only sees the reloaded test page
+        wait_ready(driver, submit_button)
+        print('Submitted question {}/{}'.format(i+1-num_leading_arrows, num_questions))
+
+def edit_questions_worker(url, cookies, hide, indices, num_leading_arrows, num_questions, randomise):
+    # Each thread needs its own browser, logged in with the shared session cookies
+    driver = new_driver(hide)
+    try:
+        # Cookies can only be added for the domain of the current page. The test
+        # url itself redirects to the login page when logged out so load the
+        # site root instead and skip any cookie that is for another host.
+        parsed = urlparse(url)
+        driver.get('{}://{}/'.format(parsed.scheme, parsed.netloc))
+        host = urlparse(driver.current_url).hostname
+        for cookie in cookies:
+            domain = cookie.get('domain', '').lstrip('.')
+            if not domain or host == domain or host.endswith('.' + domain):
+                driver.add_cookie(cookie)
+        driver.get(url)
+        if driver.find_elements(By.ID, 'topframe.login.label'):
+            raise RuntimeError('worker browser is not logged in to ' + url)
+        edit_questions(driver, indices, num_leading_arrows, num_questions, randomise)
+    finally:
+        driver.quit()
+
+def main(url, hide, randomise, workers=1):
+    driver = new_driver(hide)
     driver.get(url)
     
     print(driver.title)
@@ -96,50 +183,49 @@ def main(url, hide, randomise):
         raise(elem_error)
 
     try:
-        arrow_buttons = driver.find_elements(By.XPATH, "//*[@class='contextMenuContainer']")
-        num_questions = len(driver.find_elements(By.XPATH, "//*[@class='questionNumber autoQuestionNumber']"))
+        # Count in the browser rather than sending every element back
+        num_arrows = driver.execute_script(
+            "return document.querySelectorAll('[class=\"contextMenuContainer\"]').length")
+        num_questions = driver.execute_script(
+            "return document.querySelectorAll('[class=\"questionNumber autoQuestionNumber\"]').length")
         
         # There are n arrow buttons at the top of the page that do no
         # correspond to questions so these are ignored
-        num_leading_arrows = len(arrow_buttons)-num_questions
-        for i in range(num_leading_arrows, len(arrow_buttons)):
-            print('clicking on arrow')
-            arrow_buttons[i].click()
-            edit_buttons = driver.find_elements(By.XPATH, "//*[starts-with(@id,'modify_test')]")
-            temp_adds = driver.find_elements(By.XPATH, "//*[@class='addBeforeLink']")
-
-            assert len(edit_buttons) == 2, '\n\n  Edit button not found, run without --hide flag'
-            print('clicking on edit')
-            edit_buttons[0].click()
-            print('----PAUSE----')
-            time.sleep(1)
-            if randomise:
-                randomise_answers(driver, 'fRandomOrder')
-                randomise_answers(driver, 'randomOrderId')
-            try:
-                submit_button = driver.find_element(By.NAME, "bottom_Submit")
-            except:
-                print('failed to find submit, looking for next button')
-                next_button = driver.find_element(By.NAME, "bottom_Next")
-                print('found next button')
-                print('----PAUSE----')
-                time.sleep(1)
-                next_button.click()
-                print('clicked next button')
-                print('----PAUSE----')
-                time.sleep(1)
-                submit_button = driver.find_element(By.NAME, "bottom_Submit")
-               
-            submit_button.click()
-            print('Submitted question {}/{}'.format(i+1-num_leading_arrows, num_questions))
-            arrow_buttons = driver.find_elements(By.XPATH, "//*[@class='contextMenuContainer']")
+        num_leading_arrows = num_arrows-num_questions
+        indices = range(num_leading_arrows, num_arrows)
+        # No point starting more browsers than there are questions
+        workers = min(workers, len(indices))
+        if workers <= 1:
+            edit_questions(driver, indices, num_leading_arrows, num_questions, randomise)
+        else:
+            # Split the questions between browsers, the login is shared via cookies
+            cookies = driver.get_cookies()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(edit_questions_worker, url, cookies, hide,
+                                           indices[k::workers], num_leading_arrows,
+                                           num_questions, randomise)
+                           for k in range(workers)]
+                # Wait for every worker so that all failures are reported
+                failed = 0
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print('worker failed:', e)
+                        failed += 1
+                if failed:
+                    raise RuntimeError('{} of {} workers failed, some questions were '
+                                       'not edited'.format(failed, workers))
 
     except Exception as e:
         print("Unexpected error has occured")
         print(e)
+        status = 1
+    else:
+        status = 0
 
     driver.close()
-    return 0
+    return status
     
 
 if __name__ == '__main__':
@@ -153,4 +239,15 @@ if __name__ == '__main__':
         hide = True
     else:
         hide = False
-    sys.exit(main(sys.argv[1], hide, randomise))
+
+    if '--workers' in sys.argv[2:]:
+        try:
+            workers = int(sys.argv[sys.argv.index('--workers')+1])
+        except (IndexError, ValueError):
+            workers = 0
+        if workers < 1:
+            sys.exit("usage: bb_interact.py 'Blackboard url' [--hide] [--randomise] "
+                     "[--workers N]\nN must be a whole number of at least 1")
+    else:
+        workers = 1
+    sys.exit(main(sys.argv[1], hide, randomise, workers))
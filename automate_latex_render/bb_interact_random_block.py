@@ -30,41 +30,43 @@ The optional --randomise flag will check the box to randomise the order in
 which answers are displayed for the multi choice and multi answer questions
 """
 
-import time
 import selenium
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException, ElementClickInterceptedException
+from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import sys
 import numpy as np
 
-def randomise_answers(driver, button_id): 
-    try: 
-        # Checking for answer randomise button (assumes this is wanted) 
-        random_button = driver.find_element(By.ID, button_id) 
-        if not random_button.is_selected():
-            print('clicking "randomise answers"')
-            random_button.click()
-    
+def randomise_answers(driver, button_ids):
+    # Tick any randomise checkboxes on the page in a single round trip. A JS
+    # click is not blocked by the submit button overlapping the checkbox.
+    found = driver.execute_script("""
+        var found = 0;
+        for (var id of arguments[0]) {
+            var button = document.getElementById(id);
+            if (button) {
+                found++;
+                if (!button.checked) { button.click(); }
+            }
+        }
+        return found;""", button_ids)
+    if found:
         print('randomised answers selected')
-    except ElementClickInterceptedException:
-        # Button is obstructed by submit button so scroll down to it
-        driver.execute_script("window.scrollTo(0,1000);") 
-        try:
-            random_button.click() 
-            print('randomised answers selected')
-        except Exception as e: 
-            print('unexpected error in randomise, continuing') 
-            pass 
-    except Exception: 
-        # No randomise button found, move on
-        pass
+
+def wait_ready(driver, old_element, timeout=10):
+    # Wait for the page load triggered by the last click to finish. The old page
+    # still reports 'complete' until it is replaced so first wait for an element
+    # of it to go stale.
+    WebDriverWait(driver, timeout).until(EC.staleness_of(old_element))
+    WebDriverWait(driver, timeout).until(
+        lambda d: d.execute_script('return document.readyState') == 'complete')
 
 def login(driver):
     user = input('Please type your username: ')
-    user_in = driver.find_element(By.ID, 'username').send_keys(user)
+    user_in = WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.ID, 'username'))).send_keys(user)
 
     password = input('Please type your password: ')
     pass_in = driver.find_element(By.ID, 'password').send_keys(password)
@@ -73,9 +75,20 @@ def login(driver):
 
 def main(url, hide, randomise):
     options = webdriver.ChromeOptions()
+    # Return from driver.get() once the DOM is ready, explicit waits do the rest
+    options.page_load_strategy = 'eager'
     if hide:
         options.add_argument('headless');
+        # Only form elements are used so skip rendering anything else
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option(
+            'prefs', {'profile.managed_default_content_settings.images': 2})
     driver = webdriver.Chrome(options=options)
+    # Only explicit waits are used below, never mix them with implicit ones
+    driver.implicitly_wait(0)
     driver.get(url)
     try:
         login_button = driver.find_element(By.ID, 'topframe.login.label').click()
@@ -95,50 +108,61 @@ def main(url, hide, randomise):
         raise(elem_error)
 
     try:
-        arrow_buttons = driver.find_elements(By.XPATH, "//*[@title='Options Menu: Question Text']")
-        q_nums = driver.find_elements(By.XPATH, "//*[starts-with(@id,'totalNoQuestions')]")
+        # Count in the browser rather than sending every element back
+        num_arrows = driver.execute_script(
+            "return document.querySelectorAll(\"[title='Options Menu: Question Text']\").length")
+        q_nums = driver.find_elements(By.CSS_SELECTOR, "[id^='totalNoQuestions']")
         qs = [int(q.text) for q in q_nums]
         cum_qs = np.cumsum(qs)
-        for i in range(len(arrow_buttons)):
-            time.sleep(1)
-            previews = driver.find_elements(By.XPATH, "//*[@class='itemHead']")
+        for i in range(num_arrows):
+            previews = WebDriverWait(driver, 10).until(
+                EC.presence_of_all_elements_located((By.CSS_SELECTOR, "[class='itemHead']")))
             p = np.where(cum_qs>i)[0][0]
             print('clicking: ',p, ' preview link')
             driver.execute_script("arguments[0].scrollIntoView();", previews[p])
+            # The preview click re-renders the arrows so wait for the old ones to
+            # go stale before looking up the new ones
+            old_arrow = driver.find_element(By.CSS_SELECTOR, "[title='Options Menu: Question Text']")
             previews[p].click()
+            WebDriverWait(driver, 10).until(EC.staleness_of(old_arrow))
 
-            time.sleep(0.5)
-            arrow_buttons = driver.find_elements(By.XPATH, "//*[@title='Options Menu: Question Text']")
+            arrow_buttons = WebDriverWait(driver, 10).until(
+                EC.presence_of_all_elements_located((By.CSS_SELECTOR, "[title='Options Menu: Question Text']")))
+            WebDriverWait(driver, 10).until(EC.element_to_be_clickable(arrow_buttons[i]))
             print('clicking on arrow')
             arrow_buttons[i].click()
             print('clicked on arrow')
-            edit_buttons = driver.find_elements(By.XPATH, "//*[starts-with(@id,'context_menu_tag')]")
+            edit_buttons = WebDriverWait(driver, 10).until(
+                EC.presence_of_all_elements_located((By.CSS_SELECTOR, "[id^='context_menu_tag']")))
             #temp_adds = driver.find_elements(By.XPATH, "//*[@class='addBeforeLink']")
 
             print('clicking on edit')
             edit_buttons[0].click()
-            print('----PAUSE----')
-            time.sleep(1)
+            wait_ready(driver, edit_buttons[0])
+            # Wait for the edit page form (either a Submit or a Next button)
+            WebDriverWait(driver, 10).until(
+                lambda d: d.find_elements(By.NAME, "bottom_Submit")
+                       or d.find_elements(By.NAME, "bottom_Next"))
             if randomise:
-                randomise_answers(driver, 'fRandomOrder')
-                randomise_answers(driver, 'randomOrderId')
-            try:
-                submit_button = driver.find_element(By.NAME, "bottom_Submit")
-            except:
+                randomise_answers(driver, ['fRandomOrder', 'randomOrderId'])
+            submit_buttons = driver.find_elements(By.NAME, "bottom_Submit")
+            if submit_buttons:
+                submit_button = submit_buttons[0]
+            else:
                 print('failed to find submit, looking for next button')
-                next_button = driver.find_element(By.NAME, "bottom_Next")
+                next_button = WebDriverWait(driver, 10).until(
+                    EC.element_to_be_clickable((By.NAME, "bottom_Next")))
                 print('found next button')
-                print('----PAUSE----')
-                time.sleep(1)
                 next_button.click()
+                wait_ready(driver, next_button)
                 print('clicked next button')
-                print('----PAUSE----')
-                time.sleep(1)
-                submit_button = driver.find_element(By.NAME, "bottom_Submit")
+                submit_button = WebDriverWait(driver, 10).until(
+                    EC.presence_of_element_located((By.NAME, "bottom_Submit")))
                
             submit_button.click()
-            print('Submitted question {}/{}'.format(i+1, len(arrow_buttons)))
-        arrow_buttons = driver.find_elements(By.XPATH, "//*[@title='Options Menu: Question Text']")
+            # Make sure the next iteration only sees the reloaded test page
+            wait_ready(driver, submit_button)
+            print('Submitted question {}/{}'.format(i+1, num_arrows))
 
     except Exception as e:
         print("Unexpected error has occured")
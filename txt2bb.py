@@ -44,37 +44,43 @@ argument --bb or --latex. These functions format the question (dict) into the
 appropriate (list) format for the specified file type.
 """
 import sys
+import os
 import re
+import random
 from itertools import chain
 import subprocess
-import copy
 
 #--------------------------------Question Classes---------------------------------#
+# Patterns for answers of the form "choice : var1, var2" where "\," escapes a comma
+VARIABLE_RE = re.compile(r':.*\w')
+UNESCAPED_COMMA_RE = re.compile(r'(?<!\\),')
+# Variable names in square brackets in a JUMBLED_SENTENCE prompt
+PLACEHOLDER_RE = re.compile(r'\[([^\]]+)\]')
+# Answer key with any partial marks, e.g. "(50)correct", stripped off
+KEY_WORD_RE = re.compile('[a-zA-Z]+')
+
 class Question:
     """Defualt initialisation for all question handling classes
 
     questions (dict) -> assigns generic values to object
     """
 
+    __slots__ = ('question', 'type', 'prompt', 'answers')
+
     def __init__(self, question):
         self.question = question
         self.type = question['type']
         self.prompt = question['prompt']
         self.answers = question['answers']
 
-class MC(Question):
-    def __init__(self, question):
-        Question.__init__(self, question)
-        correct_occur = re.findall("[^in]correct",str([item[0] for item in self.answers]))
-        if len(correct_occur) != 1:
-            raise ValueError("Only 1 correct answer should be provided")
+class MA(Question):
+    __slots__ = ()
 
     def bb(self):
+        key_word = KEY_WORD_RE.search
         items = [self.type, self.prompt]
-        for correct, ans in self.answers:
-            correct = re.findall("[a-zA-Z]+",correct)[0]   
-            items.append(ans)
-            items.append(correct)
+        items += chain.from_iterable((ans, key_word(correct).group())
+                                     for correct, ans in self.answers)
         return items
 
     def latex(self):
@@ -84,27 +90,25 @@ class MC(Question):
         return items
 
 
-class MA(Question):
-    def bb(self):
-        items = [self.type, self.prompt]
-        for correct, ans in self.answers:
-            correct = re.findall("[a-zA-Z]+",correct)[0]   
-            items.append(ans)
-            items.append(correct)
-        return items
+class MC(MA):
+    # Inherits functions from multiple answer class as they are identical
+    __slots__ = ()
 
-    def latex(self):
-        items = []
-        for correct, ans in self.answers:
-            items.append((correct, ans))
-        return items
+    def __init__(self, question):
+        MA.__init__(self, question)
+        # Count correct answers, with or without partial marks
+        num_correct = sum(KEY_WORD_RE.search(key).group() == 'correct'
+                          for key, _ in self.answers)
+        if num_correct != 1:
+            raise ValueError("Only 1 correct answer should be provided")
 
 
 class TF(Question):
+    __slots__ = ()
+
     def __init__(self, question):
         Question.__init__(self, question)
-        ans_occur = re.findall("'answer'",str(self.answers))
-        if len(ans_occur) != 1:
+        if sum(key == 'answer' for key, _ in self.answers) != 1:
             raise ValueError("Only 1 answer should be provided")
         if self.answers[0][1] not in ('true','false'):
             raise ValueError("Valid answers are true or false")
@@ -119,8 +123,10 @@ class TF(Question):
 
 
 class ESS(Question):
+    __slots__ = ()
+
     def bb(self):
-        if '(' in self.answers[0][0]:
+        if self.answers and '(' in self.answers[0][0]:
             raise ValueError("No partial marks allowed for essay questions")
 
         if self.answers:
@@ -136,6 +142,8 @@ class ESS(Question):
 
 
 class ORD(Question):
+    __slots__ = ()
+
     def __init__(self, question):
         Question.__init__(self, question)
         if not 1 <= len(self.answers) <= 20:
@@ -153,11 +161,12 @@ class ORD(Question):
 
 
 class MAT(Question):
+    __slots__ = ()
+
     def __init__(self, question):
         Question.__init__(self, question)
-        mata = re.findall('match_a', str(self.answers))
-        matb = re.findall('match_b', str(self.answers))
-        if len(mata) != len(matb):
+        keys = [key for key, _ in self.answers]
+        if keys.count('match_a') != keys.count('match_b'):
             raise AssertionError("All options must have matching answers")
 
         if any('(' in item[0] for item in self.answers):
@@ -168,13 +177,15 @@ class MAT(Question):
         return [self.type, self.prompt]+[val for _,val in self.answers]
 
     def latex(self):
-        letter = ('a','b')
-        items = [(str(num//2)+letter[num%2], ans[1]) for num, ans in
-                zip(range(2,len(self.answers)+2), self.answers)]
+        # Label the pairs 1a, 1b, 2a, 2b, ...
+        items = [(str(num//2)+'ab'[num%2], ans) for num, (_, ans) in
+                enumerate(self.answers, 2)]
         return items
 
 
 class FIL(Question):
+    __slots__ = ()
+
     def bb(self):
         if any('(' in item[0] for item in self.answers):
             raise ValueError("No partial marks allowed for this question type")
@@ -185,26 +196,30 @@ class FIL(Question):
 
 
 class NUM(Question):
+    __slots__ = ('ans', 'tol')
+
     def __init__(self, question):
         Question.__init__(self, question)
+        # Tolerance is optional, None if not given
+        self.tol = None
         try:
             self.ans = str(float(self.answers[0][1]))
-            if 'tolerance' in str(self.answers):
+            if any(key == 'tolerance' for key, _ in self.answers):
                 self.tol = str(float(self.answers[1][1]))
-        except:
+        except (ValueError, IndexError):
             raise ValueError('answer and tolerance must be numbers')
 
         if any('(' in item[0] for item in self.answers):
             raise ValueError("No partial marks allowed for number questions")
 
     def bb(self):
-        if 'tolerance' in str(self.answers):
+        if self.tol is not None:
             return [self.type, self.prompt, self.ans, self.tol]
         else:
             return [self.type, self.prompt, self.ans]
 
     def latex(self):
-        if 'tolerance' in str(self.answers):
+        if self.tol is not None:
             return [('answer', self.ans), ('tolerance', r'$\pm$'+self.tol)]
         else:
             return [('answer', self.ans)]
@@ -212,15 +227,17 @@ class NUM(Question):
 
 class SR(ESS):
     # Inherits functions form essay question class as they are identical
-    pass
+    __slots__ = ()
 
 
 class OP(FIL):
     # Inherits functions form file upload question class as they are identical
-    pass
+    __slots__ = ()
 
 
 class JUMBLED_SENTENCE(Question):
+    __slots__ = ('mappings',)
+
     def __init__(self, question):
         Question.__init__(self, question)
         self.mappings = {}
@@ -231,94 +248,80 @@ class JUMBLED_SENTENCE(Question):
 
         for ans in answers:
             # Check if variable(s) have been linked to the choice
-            if re.search(r':.*\w',ans):
-                choice, variables = map(str.strip,ans.split(':'))
+            if VARIABLE_RE.search(ans):
+                choice, _, variables = map(str.strip,ans.partition(':'))
+                # Split at commas if not escaped with \
+                parts = UNESCAPED_COMMA_RE.split(variables)
                 # Check if multiple variables (separated by commas) are present
-                if re.search(r'(?<!\\),',variables):
-                    # Split at commas if not escaped with \
-                    var = list(map(str.strip, variables.split(',')))
+                if len(parts) > 1:
+                    var = [v.strip() for v in parts]
                     var_list += var
                 else:
                     # Otherwise save the single variable (removing any escape slashes)
-                    var = variables.replace('\\','')
-                    var_list.append(var)
+                    var = [variables.replace('\\','')]
+                    var_list += var
             else:
-                choice, var = ans.strip(':'), None
+                choice, var = ans.strip(':'), []
 
             self.mappings[choice] = var
 
-        if any(' ' in var for var in var_list):
-            raise ValueError('no space are allowed in variable names')
-        if not all(var in self.prompt for var in var_list):
-            raise ValueError('missing variables from prompt')
+        placeholders = {var.strip() for var in PLACEHOLDER_RE.findall(self.prompt)}
+        for var in var_list:
+            if ' ' in var:
+                raise ValueError('no space are allowed in variable names')
+            if var not in placeholders:
+                raise ValueError('missing variables from prompt')
         if not (self.prompt.count('[') == self.prompt.count(']') == len(var_list)):
             raise ValueError("""incorrect number of brackets in prompt\n
             ---Make sure "[" or "]" do not appear apart from around variables---\n""")
 
     def bb(self):
         items = [self.type, self.prompt]
-        for choice, var in self.mappings.items():
-            items.append(choice)
-            if type(var) == list:
-                items += var
-            elif var is None:
-                pass
-            else:
-                items.append(var)
-            items.append('')
+        # Each choice is followed by its (possibly empty) list of variables
+        items += chain.from_iterable((choice, *var, '')
+                                     for choice, var in self.mappings.items())
         return items
 
     def latex(self):
-        items = []
-        for choice, var in self.mappings.items():
-            if type(var) == list:
-                items.append((choice, ', '.join(var)))
-            else:
-                items.append((choice,str(var)))
+        # Choices not linked to any variable are distractors
+        items = [(choice, ', '.join(var) or 'None')
+                 for choice, var in self.mappings.items()]
         return items
 
 
 class FIB_PLUS(Question):
     # Fill in the blank (multiple blanks)
+    __slots__ = ('mappings',)
+
     def __init__(self, question):
         Question.__init__(self, question)
         answers = [ans for _,ans in self.answers]
         self.mappings = {}
         for ans in answers:
             # Check variable has been linked to the choice
-            if re.search(r':.*\w',ans):
-                variable, answers = map(str.strip,ans.split(':'))
+            if VARIABLE_RE.search(ans):
+                variable, _, answers = map(str.strip,ans.partition(':'))
+                # Split at commas if not escaped with \
+                parts = UNESCAPED_COMMA_RE.split(answers)
                 # Check if multiple variables (separated by commas) are present
-                if re.search(r'(?<!\\),',answers):
-                    # Split at commas if not escaped with \
-                    tmp_ans = answers.replace('\\,','¡') 
-                    ans = list(map(str.strip, tmp_ans.split(',')))
-                    ans = [a.replace('¡',',') for a in ans]
+                if len(parts) > 1:
+                    ans = [a.strip().replace('\\,', ',') for a in parts]
                 else:
                     # Otherwise save the single variable (removing any escape slashes)
-                    ans = answers.replace('\\','')
+                    ans = [answers.replace('\\','')]
 
                 self.mappings[variable] = ans
             else:
                 raise ValueError('Variable is not given answers')
     def bb(self):
         items = [self.type, self.prompt]
-        for var, ans in self.mappings.items():
-            items.append(var)
-            if type(ans) == list:
-                items += ans
-            else:
-                items.append(ans)
-            items.append('')
+        # Each variable is followed by its list of accepted answers
+        items += chain.from_iterable((var, *ans, '')
+                                     for var, ans in self.mappings.items())
         return items
 
     def latex(self):
-        items = []
-        for var, ans in self.mappings.items():
-            if type(ans) == list:
-                items.append((var, ', '.join(ans)))
-            else:
-                items.append((var,str(ans)))
+        items = [(var, ', '.join(ans)) for var, ans in self.mappings.items()]
         return items
 
 # Tuple of all classes for use in dictionary in txt2bb
@@ -328,50 +331,128 @@ q_handlers = (MC, MA, TF, ESS, ORD, MAT, FIL, NUM, SR, OP, JUMBLED_SENTENCE, FIB
 #-----------------------------------File Handling-------------------------------------#
 Q_TYPES = ('MC', 'MA', 'TF', 'ESS', 'ORD', 'MAT', 'FIL', 'NUM', 'SR', 'OP',
         'JUMBLED_SENTENCE', 'FIB_PLUS')
-IN_TYPES = ('correct', 'incorrect', 'answer', 'match_a', 'match_b', 'example',
-        'tolerance', 'variable', 'q_word', 'q_phrase', 'notes')
+IN_TYPES = frozenset(('correct', 'incorrect', 'answer', 'match_a', 'match_b',
+        'example', 'tolerance', 'variable', 'q_word', 'q_phrase', 'notes'))
+# All keys that may appear on the left of a "key: val" line
+KEYS = IN_TYPES | {'type', 'prompt'}
 HANDLERS = dict(zip(Q_TYPES, q_handlers))
-
-def main(out_format, random, filename, out_file):
+# Question types whose answers are shuffled with --randomise
+SHUFFLE_TYPES = frozenset(('MA', 'MC', 'JUMBLED_SENTENCE'))
+
+# Continuation lines, joined in a single pass before tokenising in txt2py.
+# A newline followed by '>' is a linebreak in the text and becomes the <br>
+# placeholder. A newline after '\\' (e.g. in a bmatrix) or escaped with '\'
+# is flattened.
+CONTINUATION_RE = re.compile(
+        r'(?P<br> *\n> *)|(?P<matrix> *\\\\\n(?!>) *)|(?P<escaped>\\\n(?!>))')
+CONTINUATIONS = {'br': '<br>', 'matrix': r'\\', 'escaped': ''}
+
+# Each line of the (flattened) input is a comment, the start of a new
+# question or a "key: val" pair. Any other line is ignored.
+LINE_RE = re.compile(r'^(?:(#.*)|(-------.*)|([^:\n]*):(.*))$', re.MULTILINE)
+
+# Variant lists are encased by %{ }% and split at commas not escaped with \
+VARIANT_RE = re.compile(r'%{(.*?)}%')
+VARIANT_SPLIT_RE = re.compile(r' *(?<!\\), *')
+# Subnumbering added to the prompt of each variant
+VARIANT_NUM_RE = re.compile(r"\\hspace{-5pt}\d+\. ")
+# Images are given as @{filename}@
+IMAGE_RE = re.compile('@{(.+?)}@')
+# Images and display math in a tab-delimited Blackboard line, an image
+# pointer never spans more than one field
+BB_OUTPUT_RE = re.compile(r'@{([^\t\n]+?)}@|\$\$')
+UNESCAPED_PERCENT_RE = re.compile(r'(?<!\\)%')
+EQUATION_RE = re.compile(r'\$+[^\$]*\$+')
+
+# Known causes of problems when uploading to Blackboard, checked by
+# parse_checker. Each pattern is paired with the message for its first match.
+PARSE_WARNINGS = (
+    (re.compile(r'<\S'),
+     '"<" on line {} should have a space after it to avoid HTML clashes.'),
+    (re.compile(r'.\S>'),
+     '">" on line {} should have a space before it to avoid HTML clashes.'),
+)
+PARSE_ERRORS = (
+    (r'\t', 'Tab used on line {}. Instead use spaces.'),
+    (r'\\text{', '"\\text{{}}" used on line {}. Instead use "\\mathrm{{}}".'),
+    (r'\\def{', '"\\def{{}}" used in line {}. Not supported in MathJax.'),
+    (r'\\mathrm{[^ }]* ',
+     'Space used within "\\mathrm{{}}" on line {}. Instead use "\\,".'),
+)
+# All errors are found in a single scan, the group that matched gives the message
+PARSE_ERRORS_RE = re.compile('|'.join('(%s)' % expr for expr, _ in PARSE_ERRORS))
+
+# Rewrites for answers in latex_item. The line break symbol <br> from txt2py()
+# becomes a latex line break, any % not already escaped (also not after the
+# new line break) is escaped as it comments out the line in Latex and $$ is
+# made inline to prevent answer lines from showing up in display mode.
+LATEX_ANSWER_RE = re.compile(r'<br>|(?<!\\)(?<!<br>)%|\$\$')
+LATEX_ANSWER = {'<br>': r'\\', '%': r'\%', '$$': '$'}
+
+def main(out_format, randomise, filename, out_file):
    
+    questions = read_questions(filename, randomise)
+    write_questions(out_format, questions, out_file)
+
+    return 0
+
+def read_questions(filename, randomise):
+    """Parse, expand variants and validate all questions in a file
+
+    filename (str) -> list of questions (dict) with their handlers
+    """
     raw_questions = txt2py(filename)
     questions = []
 
     for question in raw_questions:
-        # Check if variants are included in the question
-        if re.search('%{', str(question)):
+        # Check if variants are included in the prompt or any answer key/value
+        fields = chain((question.get('prompt', ''),), *question['answers'])
+        if any('%{' in text for text in fields):
             questions += produce_variant_questions(question)
         else:
             question['new'] = True
             questions.append(question)
     
     # Randomise applicable questions if specified
-    if random:
-        import random
+    if randomise:
+        shuffle = random.shuffle
         for question in questions:
-            if question['type'] in ['MA','MC','JUMBLED_SENTENCE']:
-                random.shuffle(question['answers'])
+            if question['type'] in SHUFFLE_TYPES:
+                shuffle(question['answers'])
 
+    # Validate each question once and keep its handler for the output pass
+    for question in questions:
+        # Notes are written for the pdf version only and are not an answer
+        keys = [item[0] for item in question['answers']]
+        question['notes'] = ''
+        if 'notes' in keys:
+            question['notes'] = question['answers'].pop(keys.index('notes'))[1]
+        handler = HANDLERS.get(question["type"])
+        if handler is None:
+            raise ValueError("Unrecognised question type")
+        question['handler'] = handler(question)
+
+    return questions
+
+def write_questions(out_format, questions, out_file):
+    """Write questions in the given format, they can be written more than once"""
     if out_format == "--latex":
         lines = q2latex(questions)
     elif out_format == "--bb":
         lines = q2bb(questions)
     with open(out_file,'w') as out:
-        for line in lines:
-            print(line, file=out)
-
-    return 0
+        out.writelines(line + '\n' for line in lines)
 
 def extract_variants(question):
     # Find all options encased by %{ }%
     unboxed_question = question['answers'] + [('prompt', question['prompt'])] 
     variants = []
     for in_type, text in unboxed_question:
-        text_variants = re.findall(r'%{(.*?)}%', text)
-        type_variants = re.findall(r'%{(.*?)}%', in_type)
+        text_variants = VARIANT_RE.findall(text)
+        type_variants = VARIANT_RE.findall(in_type)
         # Split list at ',' if not escaped with \ and add to labelled list of variants
-        variants.append(([re.split(r' *(?<!\\), *', item) for item in type_variants], 
-                         [re.split(r' *(?<!\\), *', item) for item in text_variants]))
+        variants.append(([VARIANT_SPLIT_RE.split(item) for item in type_variants],
+                         [VARIANT_SPLIT_RE.split(item) for item in text_variants]))
     
     # Check all options can be matched up (equal length option lists)
     lens = [len(i) for _,text in variants for i in text] + [len(i) for typ,_ in variants for i in typ]
@@ -379,6 +460,12 @@ def extract_variants(question):
         raise ValueError("\n\n  All variants must be the same length\n")
     return variants, lens[0]
 
+def substitute_variants(text, variant_lists, i):
+    """Swap the kth variant list in text for the ith entry of variant_lists[k]"""
+    lists = iter(variant_lists)
+    # Replace escaped ',' in current variant
+    return VARIANT_RE.sub(lambda m: next(lists)[i].replace('\\,',','), text)
+
 def produce_variant_questions(question):
     """Produce all specified variants of questions
 
@@ -386,34 +473,27 @@ def produce_variant_questions(question):
     """
     question_variants = []
     variants, num_variants = extract_variants(question)
+    # Each item that can contain variants paired with its variant lists, the
+    # same for every variant so these are only paired up once
+    items = question['answers'] + [('prompt', question['prompt'])]
+    fields = list(zip(items, variants))
     for i in range(num_variants):
-        # Create new question using the ith entries in variant lists
-        var_question = copy.deepcopy(question)
+        # Create new question using the ith entries in variant lists, the
+        # answers and prompt are replaced below so a shallow copy is enough
+        var_question = dict(question)
         question_variants.append(var_question)
-        var_question['prompt'] = r"\hspace{-5pt}%d. "%(i+1)+var_question['prompt']
         # Go through each item that can contain variants and switch them out
-        for j, item in enumerate(var_question['answers'] + [('prompt', var_question['prompt'])]):
-            # Find any variant lists in item that need to be swapped out for their ith variant 
-            type_replace = re.findall('%{.*?}%', item[0])
-            text_replace = re.findall('%{.*?}%', item[1])
-            for k, entry in enumerate(text_replace):
-                # Replace escaped ',' in current variant
-                var = variants[j][1][k][i].replace('\,',',')
-                if item[0] == 'prompt':
-                    var_question['prompt'] = var_question['prompt'].replace(entry, var)
-                else:
-                    in_type, text = var_question['answers'][j]
-                    var_question['answers'][j] = (in_type,text.replace(entry, var))
-            for k, entry in enumerate(type_replace):
-                # Replace escaped , in current variant
-                var = variants[j][0][k][i].replace('\,',',')
-                in_type, text = var_question['answers'][j]
-                var_question['answers'][j] = (in_type.replace(entry, var), text)
+        answers = [(substitute_variants(in_type, type_vars, i),
+                    substitute_variants(text, text_vars, i))
+                   for (in_type, text), (type_vars, text_vars) in fields]
+        _, prompt = answers.pop()
+        var_question['answers'] = answers
+        var_question['prompt'] = r"\hspace{-5pt}%d. "%(i+1)+prompt
 
 
         # Check all in_types are valid for each variant
-        if any(re.findall("[a-zA-Z]+",typ)[0] not in IN_TYPES + ('type', 'prompt') for typ,_ in var_question['answers']):
-            key = list(set(typ for typ,_ in var_question['answers']) - set(IN_TYPES+('type', 'prompt')))[0]
+        if any(KEY_WORD_RE.search(typ).group() not in KEYS for typ,_ in var_question['answers']):
+            key = list(set(typ for typ,_ in var_question['answers']) - KEYS)[0]
             q = var_question['prompt'][:100]+'...' if len(var_question['prompt']) > 100 else var_question['prompt']
             msg = '\n\n    Unrecognised key "{}" for question "{}"\n'.format(key,q)
             raise ValueError(msg)
@@ -421,18 +501,16 @@ def produce_variant_questions(question):
     question_variants[0]['new'] = True
     return question_variants
 
-def error_check_raise(file_name, expr, text, msg):
-    if re.search(expr, text):
-        pos = re.search(expr, text).start()
-        line = text[:pos].count('\n') + 1
-        msg = '\n\n   '+file_name+': '+msg.format(line)+'\n'
-        raise SyntaxError(msg)
+def error_raise(file_name, text, pos, msg):
+    line = text.count('\n', 0, pos) + 1
+    msg = '\n\n   '+file_name+': '+msg.format(line)+'\n'
+    raise SyntaxError(msg)
 
 def warning_check_raise(file_name, expr, text, msg):
     import warnings
-    if re.search(expr, text):
-        pos = re.search(expr, text).start()
-        line = text[:pos].count('\n') + 1
+    match = expr.search(text)
+    if match:
+        line = text.count('\n', 0, match.start()) + 1
         msg = '\n\n\n   '+file_name+': '+msg.format(line)+'\n\n'
         warnings.warn(msg)
 
@@ -440,63 +518,49 @@ def parse_checker(file_name, text):
     """Run through all known causes of errors when uploading to Blackboard and
     raise them to be fixed before any files are produced.
     """
-    msg = '"<" on line {} should have a space after it to avoid HTML clashes.'
-    warning_check_raise(file_name, '<\S', text, msg)
-    msg = '">" on line {} should have a space before it to avoid HTML clashes.'
-    warning_check_raise(file_name, '.\S>', text, msg)
-    msg = 'Tab used on line {}. Instead use spaces.'
-    error_check_raise(file_name, r'\t', text, msg)
-    msg = '"\\text{{}}" used on line {}. Instead use "\\mathrm{{}}".'
-    error_check_raise(file_name, r'\\text{', text, msg)
-    msg = '"\\def{{}}" used in line {}. Not supported in MathJax.'
-    error_check_raise(file_name, r'\\def{', text, msg)
-    msg = 'Space used within "\\mathrm{{}}" on line {}. Instead use "\\,".'
-    error_check_raise(file_name, r'\\mathrm{[^ }]* ', text, msg)
+    for expr, msg in PARSE_WARNINGS:
+        warning_check_raise(file_name, expr, text, msg)
+    match = PARSE_ERRORS_RE.search(text)
+    if match:
+        error_raise(file_name, text, match.start(), PARSE_ERRORS[match.lastindex-1][1])
     msg = 'Space used in equation on line {}. Delete or replace with "{{}}" if needed.'
-    eqs = re.findall(r'\$+[^\$]*\$+', text)
-    for eq in eqs:
-        if ' ' in eq:
-            error_check_raise(file_name, re.escape(eq[eq.index(' '):]), text, msg)
+    for eq in EQUATION_RE.finditer(text):
+        if ' ' in eq.group():
+            error_raise(file_name, text, eq.start() + eq.group().index(' '), msg)
 
 def txt2py(filename):
     """Parse input text format into Python objects.
 
-    list of lines (str) -> list of questions (dict)
+    filename (str) -> questions (dict), yielded as each one is completed
     """
 
-    questions = []
+    question = None
     with open(filename, 'r') as infile:
         text = infile.read()
 
     parse_checker(filename, text)
 
     # Inserting linebreak character for --bb case (<br>), this then
-    # functions as placeholder for --latex case (\\)
-    text = re.sub(' *\n> *','<br>', text)
-    
-    # This appears when using bmatrix etc. and should be flattened
-    text = re.sub(r' *\\\\\n *',r'\\\\', text)
-    # This flattens newlines that are escaped with '\'
-    text = re.sub(r'\\\n','', text)
+    # functions as placeholder for --latex case (\\). Newlines in matrices
+    # or escaped with '\' are flattened in the same pass.
+    text = CONTINUATION_RE.sub(lambda m: CONTINUATIONS[m.lastgroup], text)
 
-    lines = text.splitlines()
-
-    for lineno, line in enumerate(lines, 1):
-        # Skip comments or blank lines
-        if not line or line.startswith('#'):
+    for comment, start, key, val in LINE_RE.findall(text):
+        # Skip comments
+        if comment:
             continue
 
         # Start of a new question
-        elif line.startswith("-------"):
+        elif start:
+            if question is not None:
+                yield question
             question = {}
             question['answers'] = []
-            questions.append(question)
             # Variant question by default, new questions will be marked True
             question['new'] = False
 
         # key : val
-        elif ':' in line:
-            key, val = line.split(':',1)
+        else:
             key = key.strip()
             val = val.strip()
 
@@ -505,7 +569,8 @@ def txt2py(filename):
             else:
                 question['answers'].append((key,val))
 
-    return questions
+    if question is not None:
+        yield question
 
 
 def q2bb(questions):
@@ -519,26 +584,25 @@ def q2bb(questions):
 
 def q2bb1(question):
     """Convert question into Blackboard tab delimited format"""
-    if question["type"] in Q_TYPES:
-        handler = HANDLERS[question["type"]](question)
-    else:
-        raise ValueError("Unrecognised question type")
-    items = handler.bb()
+    items = question['handler'].bb()
     # Check if variant subnumbering is present and remove
-    var_num = re.findall(r"\\hspace{-5pt}\d+\. ", items[1])
-    if var_num: items[1] = items[1].strip(var_num[0])
+    var_num = VARIANT_NUM_RE.match(items[1])
+    if var_num: items[1] = items[1][var_num.end():]
 
     # Add Separating new line after question to avoid overcrowded look
     items[1]+='<p></p>'
+    # Output must be tab-delimited, image pointers and display math are then
+    # rewritten over the whole line in one pass
+    return BB_OUTPUT_RE.sub(bb_output_sub, "\t".join(items))
+
+def bb_output_sub(match):
+    image = match.group(1)
+    if image is None:
+        # Blackboard already uses $$ for its inbuilt display math mode so
+        # these are changed to the MathJax configured one
+        return '~~'
     # Add image pointers for uploader to replace with actual image
-    for i in range(len(items)):
-        items[i] = re.sub('@{(.+?)}@', r'+++FIGURE "\1" HERE+++', items[i])
-    # Remove notes written for pdf version
-    if 'notes' in items:
-        del items[items.index('notes')-1:items.index('notes')+1]
-    # Output must be tab-delimited, blackboard already uses $$ for its inbuilt
-    # display math mode so these are changed to the MathJax configured one
-    return "\t".join(items).replace("$$","~~")
+    return '+++FIGURE "%s" HERE+++' % image.replace("$$","~~")
 
 
 LATEX_START = r"""
@@ -569,18 +633,27 @@ def q2latex(questions):
     yield from latex_enumerate(questions, q2latex1, 1)
     yield from LATEX_END.splitlines()
 
+def latex_images(text):
+    """Add specified images to Latex version at 0.7*textwidth"""
+    # Most text has no images so skip the substitution entirely
+    if '@{' not in text:
+        return text
+    return IMAGE_RE.sub(r'\\includegraphics[width=0.7\\textwidth]{\1}', text)
+
 def latex_item(item):
     typ, ans = item
-    # Replaces line break symbol <br> from txt2py() and returns latex formatted line
-    ans = ans.replace('<br>',r'\\')
-    # Escape any % that aren't already as they comment out the line in Latex
-    ans = re.sub(r'(?<!\\)%','\\%', ans)
-    # Prevent answer lines from showing up in display mode
-    ans = ans.replace('$$',r'$')
+    # Add specified images to answers aswell since this is (sort of) supported aswell.
+    # Some handlers (e.g. JUMBLED_SENTENCE) put the answer text in the first element.
+    if isinstance(typ, str):
+        typ = latex_images(typ)
+    ans = latex_images(ans)
+    # Replace line break symbols, unescaped % and display math in one pass
+    ans = LATEX_ANSWER_RE.sub(lambda m: LATEX_ANSWER[m.group()], ans)
     # Handle partial marks
-    if '(' in str(typ):
-        par_cred = typ[typ.index('('):typ.index(')')+1]
-        typ = re.findall("[a-zA-Z]+", typ)[0]
+    _, paren, marks = str(typ).partition('(')
+    if paren:
+        par_cred = '(' + marks.partition(')')[0] + ')'
+        typ = KEY_WORD_RE.search(typ).group()
         return [r"\textbf{{{}}} - \emph{{{}}}: {}".format(par_cred, typ, ans)]
 
     return [r"\emph{{{}}}: {}".format(typ, ans)]
@@ -590,42 +663,33 @@ def q2latex1(question):
 
     question (dict) -> lines of output (latex)
 
-    The result is a fragment of latex.
+    The result is a fragment of latex, joined into a single multi-line string.
     """
     # Replaces line break symbol <br> from txt2py() and returns latex formatted line
     prompt = question['prompt'].replace('<br>',r'\\\\')
     # Escape any % that aren't already as they comment out the line in Latex
-    prompt = re.sub(r'(?<!\\)%','\\%', prompt)
-    # Add specified images to Latex version at 0.7*textwidth
-    prompt = re.sub('@{(.+?)}@', r'\\includegraphics[width=0.7\\textwidth]{\1}', prompt)
-    # Add specified images to answers aswell since this is (sort of) supported aswell
-    for i in range(len(question['answers'])):
-        text_with_im = re.sub('@{(.+?)}@',r'\\includegraphics[width=0.7\\textwidth]{\1}', question['answers'][i][1])
-        question['answers'][i] = (question['answers'][i][0], text_with_im)
-               
-    yield prompt
-    if question['type'] in Q_TYPES:
-        notes = ''
-        keys = [item[0] for item in question['answers']]
-        if 'notes' in keys:
-            notes = question['answers'].pop(keys.index('notes'))[1]
-        handler = HANDLERS[question["type"]](question)
-        items = handler.latex()
-        if not items and not notes:
-            pass
+    prompt = UNESCAPED_PERCENT_RE.sub('\\%', prompt)
+    # Add specified images to Latex version
+    prompt = latex_images(prompt)
+    notes = latex_images(question['notes'])
+
+    lines = [prompt]
+    items = question['handler'].latex()
+    if not items and not notes:
+        pass
+    else:
+        # Enumeration not needed if 1 element or different pairings used
+        if len(items) == 1 or question["type"] in ('ORD','MAT','JUMBLED_SENTENCE'):
+            for item in items:
+                lines.append("")
+                lines.extend(latex_item(item))
+            lines.append("")
         else:
-            # Enumeration not needed if 1 element or different pairings used
-            if len(items) == 1 or question["type"] in ('ORD','MAT','JUMBLED_SENTENCE'):
-                for item in items:
-                    yield ""
-                    yield from latex_item(item)
-                yield ""
-            else:
-                yield from latex_enumerate(items, latex_item, 2)
+            lines.extend(latex_enumerate(items, latex_item, 2))
 
-            if notes: yield r"\textbf{Notes: }"+notes
-    else:
-        raise ValueError("Unrecognised question type")
+        if notes: lines.append(r"\textbf{Notes: }"+notes)
+
+    return ["\n".join(lines)]
 
 
 def latex_enumerate(items, latex_item_func, level):
@@ -642,19 +706,21 @@ def latex_enumerate(items, latex_item_func, level):
         yield from latex_item_func(item)
     yield ENUM_END
 
-def make_outfiles(out_format, random, in_files, out_file):
+def make_outfiles(out_format, randomise, in_files, out_file):
     for f in in_files:
-        f_pure = f[:-4]
+        f_pure = os.path.splitext(f)[0]
         if out_format == '--bb':
             bb_file = f_pure+'_bb.txt' if not out_file else out_file
-            main(out_format, random, f, bb_file)
+            main(out_format, randomise, f, bb_file)
         
         elif out_format == '--latex':
             latex_file = f_pure+'.tex' if not out_file else out_file
-            main(out_format, random, f, latex_file)
+            main(out_format, randomise, f, latex_file)
         else:
-            main('--bb', random, f, f_pure+'_bb.txt')
-            main('--latex', random, f, f_pure+'.tex')
+            # Parse once so both files share the same (randomised) questions
+            questions = read_questions(f, randomise)
+            write_questions('--bb', questions, f_pure+'_bb.txt')
+            write_questions('--latex', questions, f_pure+'.tex')
             subprocess.run(['pdflatex',f_pure+'.tex'])
 
 if __name__ == "__main__":
@@ -662,8 +728,8 @@ if __name__ == "__main__":
     if out_format not in ['--bb','--latex','--all']:
         raise ValueError('\n---Out format must be --bb,--latex, or --all---\n')
 
-    random = True if sys.argv[2]=='--randomise' else False
-    files = sys.argv[3:] if random else sys.argv[2:]
+    randomise = True if sys.argv[2]=='--randomise' else False
+    files = sys.argv[3:] if randomise else sys.argv[2:]
     out_file = None
 
     if '--output' in files:
@@ -672,5 +738,5 @@ if __name__ == "__main__":
         if len(files) != 1:
             raise ValueError('\n---Only 1 input file permitted if output file specified---\n')
     
-    make_outfiles(out_format, random, files, out_file)
+    make_outfiles(out_format, randomise, files, out_file)
     